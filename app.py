@@ -6,13 +6,13 @@
 #
 # No extra dependencies.
 
-import difflib, json, re, time, uuid
+import codecs, difflib, json, os, re, time
 import streamlit as st
 import streamlit.components.v1 as components
-from typing import List, Dict, Any
+from html import escape as html_escape
+from typing import List, Dict, Any, Iterable, Iterator
 
-def render_about_sidebar():
-    about_html = """
+_ABOUT_HTML = """
     <style>
       .about-box{
         background: #0f172a0d; /* subtle slate tint */
@@ -81,7 +81,7 @@ def render_about_sidebar():
       <h3>Metrics (how they’re calculated)</h3>
       <ul>
         <li><b>Character similarity</b><br/>
-          Uses <span class="code">difflib.SequenceMatcher(a, b).ratio()</span> over raw strings.<br/>
+          Uses <span class="code">difflib.SequenceMatcher(a, b).ratio()</span> over raw strings (common prefix/suffix trimmed first and counted as matching).<br/>
           Returns a value in <span class="code">[0,1]</span>. We also show <b>% different</b> ≈ <span class="code">(1 − similarity) × 100</span>.
         </li>
         <li><b>Line similarity</b><br/>
@@ -112,9 +112,10 @@ def render_about_sidebar():
       <p class="dim">No data leaves this app unless you download or append. Use JSONL to accumulate a dataset for LLM-based review later.</p>
     </div>
     """
-    import streamlit as st
+
+def render_about_sidebar():
     with st.sidebar:
-        st.markdown(about_html, unsafe_allow_html=True)
+        st.markdown(_ABOUT_HTML, unsafe_allow_html=True)
 
 
 
@@ -122,115 +123,216 @@ def render_about_sidebar():
 
 # ------------------ Utilities: metrics, diff, parsing, heuristics ------------------
 
-def similarity_scores(a: str, b: str):
-    sm_char = difflib.SequenceMatcher(None, a, b, autojunk=True).ratio()
-    sm_line = difflib.SequenceMatcher(None, a.splitlines(), b.splitlines(), autojunk=True).ratio()
-    toks_a = set(re.findall(r"\w+", a.lower()))
-    toks_b = set(re.findall(r"\w+", b.lower()))
-    jacc = (len(toks_a & toks_b) / len(toks_a | toks_b)) if (toks_a or toks_b) else 1.0
+_WORD_RE = re.compile(r"\w+")
+
+def _word_tokens(s: str) -> frozenset:
+    # lowercase per match instead of copying the whole input with s.lower()
+    return frozenset(m.group().lower() for m in _WORD_RE.finditer(s))
+
+def _trim_common(a, b):
+    """
+    Strip the common prefix and suffix of two sequences (str or list).
+    Returns (a_core, b_core, trimmed) where trimmed = prefix length + suffix length.
+    """
+    n = min(len(a), len(b))
+    # binary search on slice equality: the comparisons run in C instead of a per-item Python loop
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    i = lo
+    lo, hi = 0, n - i
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    j = lo
+    return a[i:len(a) - j], b[i:len(b) - j], i + j
+
+def _core_ratio(a_core, b_core, trimmed: int, total: int) -> float:
+    # SequenceMatcher.ratio() computed only over the differing core; shared prefix/suffix count as matches
+    if not total:
+        return 1.0
+    matches = trimmed
+    if a_core and b_core:
+        matches += sum(blk.size for blk in difflib.SequenceMatcher(None, a_core, b_core, autojunk=True).get_matching_blocks())
+    return 2.0 * matches / total
+
+def _trimmed_ratio(a, b) -> float:
+    return _core_ratio(*_trim_common(a, b), len(a) + len(b))
+
+def _jaccard(toks_a: frozenset, toks_b: frozenset) -> float:
+    if not (toks_a or toks_b):
+        return 1.0
+    # C-level set intersection (it probes from the smaller set); a sorted two-pointer merge in Python is ~10x slower
+    inter = len(toks_a & toks_b)
+    return inter / (len(toks_a) + len(toks_b) - inter)
+
+# Beyond these sizes SequenceMatcher's quadratic behaviour can stall the app
+_APPROX_MAX_TOTAL_CHARS = 2_000_000
+_APPROX_MAX_CHAR_PRODUCT = 50_000_000
+
+def _core_too_large(la: int, lb: int) -> bool:
+    if la + lb > _APPROX_MAX_TOTAL_CHARS:
+        return True
+    return la * lb > _APPROX_MAX_CHAR_PRODUCT and abs(la - lb) / max(la, lb, 1) > 0.5
+
+def use_approx_similarity(a: str, b: str) -> bool:
+    """
+    True when similarity_scores falls back to line-set Jaccard instead of SequenceMatcher.
+    Decided on the differing core left after trimming the common prefix/suffix, as similarity_scores does.
+    """
+    if a is b or a == b:
+        return False
+    a_core, b_core, _ = _trim_common(a, b)
+    return _core_too_large(len(a_core), len(b_core))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def similarity_scores(a: str, b: str, _a_lines: List[str] = None, _b_lines: List[str] = None):
+    # _a_lines/_b_lines: optional a.splitlines()/b.splitlines() from the caller; underscored so st.cache_data does not hash them
+    if a is b or a == b:
+        # SequenceMatcher does not short-circuit identical inputs
+        return 1.0, 1.0, 1.0
+    a_lines = _a_lines if _a_lines is not None else a.splitlines()
+    b_lines = _b_lines if _b_lines is not None else b.splitlines()
+    jacc = _jaccard(_word_tokens(a), _word_tokens(b))
+    a_core, b_core, trimmed = _trim_common(a, b)
+    if _core_too_large(len(a_core), len(b_core)):
+        # O(n) fallback: line-set Jaccard stands in for both SequenceMatcher ratios (same test as use_approx_similarity)
+        line_jacc = _jaccard(frozenset(a_lines), frozenset(b_lines))
+        return line_jacc, line_jacc, jacc
+    sm_char = _core_ratio(a_core, b_core, trimmed, len(a) + len(b))
+    sm_line = _trimmed_ratio(a_lines, b_lines)
     return sm_char, sm_line, jacc
 
+# line boundaries str.splitlines() honours besides "\n"
+_OTHER_EOL_RE = re.compile("[\r\v\f\x1c-\x1e\x85\u2028\u2029]")
+
 def to_lines(s: str, strip_ws: bool) -> List[str]:
     if strip_ws:
-        return [line.strip() + "\n" for line in s.splitlines()]
-    return [line + ("\n" if not line.endswith("\n") else "") for line in s.splitlines()]
-
-def unified_diff_text(left_lines: List[str], right_lines: List[str], left_name: str, right_name: str, n_context: int = 3) -> str:
-    return "\n".join(difflib.unified_diff(
+        return [f"{line.strip()}\n" for line in s.splitlines()]
+    if _OTHER_EOL_RE.search(s):
+        # normalise \r\n and friends to "\n"
+        return [line + "\n" for line in s.splitlines()]
+    lines = s.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    return lines
+
+def iter_unified(left_lines: List[str], right_lines: List[str], left_name: str, right_name: str, n_context: int = 3) -> Iterator[str]:
+    yield from difflib.unified_diff(
         left_lines, right_lines, fromfile=left_name, tofile=right_name, n=n_context, lineterm=""
-    )) or "(no differences)"
+    )
 
+# Above either limit the UI skips the side-by-side HTML diff
+_HTML_DIFF_MAX_CHARS = 200_000
+_HTML_DIFF_MAX_LINES = 5_000
+
+_IDENTICAL_HTML = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Diff</title></head>
+<body><p><b>{left}</b> and <b>{right}</b> are identical.</p></body></html>
+"""
+
+@st.cache_data(max_entries=32, show_spinner=False)
 def html_side_by_side(left_lines: List[str], right_lines: List[str], left_name: str, right_name: str) -> str:
     # HtmlDiff builds a full HTML document
-    _ = difflib.SequenceMatcher(None, "".join(left_lines), "".join(right_lines), autojunk=True)
+    if left_lines == right_lines:
+        return _IDENTICAL_HTML.format(left=html_escape(left_name), right=html_escape(right_name))
+    # HtmlDiff keeps per-call state on the instance, so build one per call (construction is trivial)
     return difflib.HtmlDiff(wrapcolumn=80).make_file(left_lines, right_lines, left_name, right_name)
 
-def parse_unified_diff(unified: str) -> List[Dict[str, Any]]:
+_HUNK_HDR_RE = re.compile(r"@@ -(\d+),?(\d*) \+(\d+),?(\d*) @@")
+_OP_BY_PREFIX = {"-": "del", "+": "add", " ": "ctx"}
+
+def _close_hunk(h: Dict[str, Any]) -> None:
+    ops = h["ops"]
+    h["old_snippet"] = "\n".join(o["text"] for o in ops if o["op"] != "add")
+    h["new_snippet"] = "\n".join(o["text"] for o in ops if o["op"] != "del")
+
+def parse_unified_diff_stream(line_iter: Iterable[str]) -> List[Dict[str, Any]]:
     """
-    Minimal unified diff parser → hunks with ops (del/add/ctx).
+    Minimal unified diff parser → hunks with ops (del/add/ctx), in one pass over diff lines.
+    Lines may carry their trailing "\n" (as produced by iter_unified over to_lines output).
     """
     hunks = []
-    lines = unified.splitlines()
-    i = 0
-    while i < len(lines):
-        line = lines[i]
+    cur = None  # hunk being filled; None until the first valid "@@" header
+    for line in line_iter:
         if line.startswith("@@ "):
-            m = re.match(r"@@ -(\d+),?(\d*) \+(\d+),?(\d*) @@", line)
-            if not m:
-                i += 1
-                continue
-            old_start = int(m.group(1))
-            old_len = int(m.group(2) or "1")
-            new_start = int(m.group(3))
-            new_len = int(m.group(4) or "1")
-            i += 1
-            ops = []
-            old_buf, new_buf = [], []
-            while i < len(lines) and not lines[i].startswith("@@ "):
-                l = lines[i]
-                if l.startswith('-'):
-                    ops.append({"op": "del", "text": l[1:]})
-                    old_buf.append(l[1:])
-                elif l.startswith('+'):
-                    ops.append({"op": "add", "text": l[1:]})
-                    new_buf.append(l[1:])
-                elif l.startswith(' '):
-                    ops.append({"op": "ctx", "text": l[1:]})
-                    old_buf.append(l[1:]); new_buf.append(l[1:])
-                elif l.startswith("\\ No newline at end of file"):
-                    pass
-                i += 1
-                if i >= len(lines) or (i < len(lines) and lines[i].startswith("@@ ")):
-                    break
-            hunks.append({
-                "old_start": old_start, "old_len": old_len,
-                "new_start": new_start, "new_len": new_len,
-                "ops": ops,
-                "old_snippet": "\n".join(old_buf),
-                "new_snippet": "\n".join(new_buf),
-            })
-        else:
-            i += 1
+            if cur is not None:
+                _close_hunk(cur)
+            cur = None
+            if m := _HUNK_HDR_RE.match(line):
+                cur = {
+                    "old_start": int(m.group(1)), "old_len": int(m.group(2) or "1"),
+                    "new_start": int(m.group(3)), "new_len": int(m.group(4) or "1"),
+                    "ops": [],
+                }
+                hunks.append(cur)
+            continue
+        if cur is None:
+            continue
+        op = _OP_BY_PREFIX.get(line[:1])
+        if op is None:
+            # blank separators and "\ No newline at end of file" markers
+            continue
+        text = line[1:-1] if line.endswith("\n") else line[1:]
+        cur["ops"].append({"op": op, "text": text})
+    if cur is not None:
+        _close_hunk(cur)
     return hunks
 
+def parse_unified_diff(unified: str) -> List[Dict[str, Any]]:
+    return parse_unified_diff_stream(unified.splitlines())
+
 _NUMERIC_ASSIGN_RE = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(-?\d+(\.\d+)?)\s*(#.*)?$")
 
+_LOG_RE = re.compile(r"\blog\b|\blogger\b")
+_TODO_RE = re.compile(r"\btodo\b|\bfixme\b", re.IGNORECASE)
+_PW_RE = re.compile(r"password", re.IGNORECASE)
+
 def simple_heuristics(hunks: List[Dict[str, Any]]) -> Dict[str, Any]:
     risk_flags = []
     numeric_changes = []
     removed_keywords, added_keywords = [], []
 
     for h in hunks:
+        # one pass over ops; numeric assignments are matched once per line
+        del_nums: List[tuple] = []
+        add_nums: Dict[str, List[float]] = {}
         for op in h["ops"]:
-            t = op["text"]
-            if op["op"] == "del" and "try:" in t:
-                risk_flags.append("removed_try_block")
-            if op["op"] == "del" and "assert " in t:
-                risk_flags.append("removed_assert")
-            if op["op"] == "del" and re.search(r"\blog\b|\blogger\b", t):
-                risk_flags.append("removed_logging")
-            if op["op"] == "add" and re.search(r"\btodo\b|\bfixme\b", t.lower()):
-                risk_flags.append("todo_added")
+            kind, t = op["op"], op["text"]
+            if kind == "del":
+                if "try:" in t:
+                    risk_flags.append("removed_try_block")
+                if "assert " in t:
+                    risk_flags.append("removed_assert")
+                if _LOG_RE.search(t):
+                    risk_flags.append("removed_logging")
+                if _PW_RE.search(t):
+                    removed_keywords.append(t)
+                if m := _NUMERIC_ASSIGN_RE.match(t):
+                    del_nums.append((m.group(1), float(m.group(2))))
+            elif kind == "add":
+                if _TODO_RE.search(t):
+                    risk_flags.append("todo_added")
+                if _PW_RE.search(t):
+                    added_keywords.append(t)
+                if m := _NUMERIC_ASSIGN_RE.match(t):
+                    add_nums.setdefault(m.group(1), []).append(float(m.group(2)))
 
         # numeric parameter changes: foo = 5 → foo = 2
-        dels = [op["text"] for op in h["ops"] if op["op"] == "del"]
-        adds = [op["text"] for op in h["ops"] if op["op"] == "add"]
-        for d in dels:
-            md = _NUMERIC_ASSIGN_RE.match(d)
-            if md:
-                key, old_val = md.group(1), float(md.group(2))
-                for a in adds:
-                    ma = _NUMERIC_ASSIGN_RE.match(a)
-                    if ma and ma.group(1) == key:
-                        new_val = float(ma.group(2))
-                        numeric_changes.append({"key": key, "old": old_val, "new": new_val})
-                        if new_val < old_val:
-                            risk_flags.append(f"reduced_{key}")
-                        elif new_val > old_val:
-                            risk_flags.append(f"increased_{key}")
-
-        removed_keywords += [op["text"] for op in h["ops"] if op["op"] == "del" and "password" in op["text"].lower()]
-        added_keywords   += [op["text"] for op in h["ops"] if op["op"] == "add" and "password" in op["text"].lower()]
+        for key, old_val in del_nums:
+            for new_val in add_nums.get(key, ()):
+                numeric_changes.append({"key": key, "old": old_val, "new": new_val})
+                if new_val < old_val:
+                    risk_flags.append(f"reduced_{key}")
+                elif new_val > old_val:
+                    risk_flags.append(f"increased_{key}")
 
     return {
         "risk_flags": sorted(set(risk_flags)),
@@ -239,37 +341,127 @@ def simple_heuristics(hunks: List[Dict[str, Any]]) -> Dict[str, Any]:
         "added_keywords": added_keywords
     }
 
-def make_change_record(left_text: str, right_text: str, left_name="left.txt", right_name="right.txt", n_context=3, strip_ws=False):
-    left_lines  = to_lines(left_text, strip_ws)
-    right_lines = to_lines(right_text, strip_ws)
-
-    uni = unified_diff_text(left_lines, right_lines, left_name, right_name, n_context=n_context)
-    hunks = parse_unified_diff(uni)
-    sm_char, sm_line, jacc = similarity_scores(left_text, right_text)
+@st.cache_data(max_entries=32, show_spinner=False)
+def _change_payload(left_text: str, right_text: str, left_name: str, right_name: str, n_context: int, strip_ws: bool,
+                    _left_lines: List[str] = None, _right_lines: List[str] = None, _sims=None) -> Dict[str, Any]:
+    # Deterministic part of a change record. Underscored args are derived from the others, so st.cache_data does not hash them.
+    if left_text == right_text:
+        # Identical inputs: nothing to diff, skip the whole pipeline
+        n_lines = len(_left_lines) if _left_lines is not None else len(left_text.splitlines())
+        return {
+            "stats": {
+                "lines_left": n_lines, "lines_right": n_lines,
+                "char_similarity": 1.0,
+                "line_similarity": 1.0,
+                "token_jaccard": 1.0,
+                "percent_different_estimate": 0.0
+            },
+            "unified_diff": "(no differences)",
+            "hunks": [],
+            "heuristics": {"risk_flags": [], "numeric_changes": [], "removed_keywords": [], "added_keywords": []},
+        }
+
+    left_lines = _left_lines if _left_lines is not None else to_lines(left_text, strip_ws)
+    right_lines = _right_lines if _right_lines is not None else to_lines(right_text, strip_ws)
+
+    # materialize the diff lines once and feed them to both the text and the parser
+    diff_lines = list(iter_unified(left_lines, right_lines, left_name, right_name, n_context))
+    uni = "\n".join(diff_lines) or "(no differences)"
+    hunks = parse_unified_diff_stream(diff_lines)
+    sm_char, sm_line, jacc = _sims if _sims is not None else similarity_scores(left_text, right_text)
+
+    stats = {
+        "lines_left": len(left_lines), "lines_right": len(right_lines),
+        "char_similarity": round(sm_char, 4),
+        "line_similarity": round(sm_line, 4),
+        "token_jaccard": round(jacc, 4),
+        "percent_different_estimate": round((1 - sm_char) * 100, 2)
+    }
+    if use_approx_similarity(left_text, right_text):
+        # char/line similarity above are line-set Jaccard, not SequenceMatcher ratios
+        stats["similarity_method"] = "line_set_jaccard"
 
-    rec = {
-        "id": f"{time.strftime('%Y-%m-%dT%H:%M:%SZ')}_{uuid.uuid4().hex[:6]}",
-        "source": {"left_name": left_name, "right_name": right_name},
-        "stats": {
-            "lines_left": len(left_lines), "lines_right": len(right_lines),
-            "char_similarity": round(sm_char, 4),
-            "line_similarity": round(sm_line, 4),
-            "token_jaccard": round(jacc, 4),
-            "percent_different_estimate": round((1 - sm_char) * 100, 2)
-        },
+    return {
+        "stats": stats,
         "unified_diff": uni,
         "hunks": hunks,
         "heuristics": simple_heuristics(hunks),
     }
+
+def new_record_id() -> str:
+    # nanosecond timestamp (hex) + 6 random hex chars; no locale-aware strftime, no uuid4 object
+    return f"{time.time_ns():x}_{os.urandom(3).hex()}"
+
+def make_change_record(left_text: str, right_text: str, left_name="left.txt", right_name="right.txt", n_context=3, strip_ws=False,
+                       left_lines: List[str] = None, right_lines: List[str] = None, sims=None,
+                       record_id: str = None):
+    # Callers that already computed lines / similarity can pass them in to skip the rework.
+    # Batch scripts can supply their own record_id (e.g. a counter) instead of the generated one.
+    payload = _change_payload(
+        left_text, right_text, left_name, right_name, n_context, strip_ws,
+        _left_lines=left_lines, _right_lines=right_lines, _sims=sims
+    )
+    # id is fresh per record, so it stays outside the cached payload
+    rec = {
+        "id": record_id if record_id is not None else new_record_id(),
+        "source": {"left_name": left_name, "right_name": right_name},
+        **payload,
+    }
     return rec
 
 def save_jsonl(records: List[Dict[str, Any]], path: str):
-    with open(path, "a", encoding="utf-8") as f:
-        for r in records:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    with open(path, "a", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
 
 # ------------------ Streamlit UI ------------------
 
+# Bounds for the on-screen JSON preview
+_PREVIEW_MAX_HUNKS = 20
+_PREVIEW_MAX_OPS = 200            # total across all previewed hunks
+_PREVIEW_MAX_TEXT_CHARS = 500     # per op text / keyword line
+_PREVIEW_MAX_SNIPPET_CHARS = 2_000
+_PREVIEW_MAX_DIFF_CHARS = 8_000
+
+def _clip(s: str, limit: int):
+    if len(s) <= limit:
+        return s, False
+    return s[:limit] + " …", True
+
+def _preview_record(rec: Dict[str, Any]):
+    """
+    Size-bounded copy of a change record for on-screen display: caps hunks, total ops,
+    per-line text and snippets. Returns (preview, truncated).
+    """
+    truncated = len(rec["hunks"]) > _PREVIEW_MAX_HUNKS
+    ops_left = _PREVIEW_MAX_OPS
+    hunks = []
+    for h in rec["hunks"][:_PREVIEW_MAX_HUNKS]:
+        if ops_left <= 0:
+            truncated = True
+            break
+        ops = []
+        for o in h["ops"][:ops_left]:
+            text, cut = _clip(o["text"], _PREVIEW_MAX_TEXT_CHARS)
+            truncated |= cut
+            ops.append({"op": o["op"], "text": text})
+        truncated |= len(h["ops"]) > ops_left
+        ops_left -= len(ops)
+        old_snippet, cut_old = _clip(h["old_snippet"], _PREVIEW_MAX_SNIPPET_CHARS)
+        new_snippet, cut_new = _clip(h["new_snippet"], _PREVIEW_MAX_SNIPPET_CHARS)
+        truncated |= cut_old or cut_new
+        hunks.append({**h, "ops": ops, "old_snippet": old_snippet, "new_snippet": new_snippet})
+
+    heur = dict(rec["heuristics"])
+    for key in ("removed_keywords", "added_keywords"):
+        lines = heur[key]
+        clipped = [_clip(t, _PREVIEW_MAX_TEXT_CHARS)[0] for t in lines[:_PREVIEW_MAX_OPS]]
+        truncated |= len(lines) > _PREVIEW_MAX_OPS or clipped != lines[:_PREVIEW_MAX_OPS]
+        heur[key] = clipped
+
+    uni, cut = _clip(rec["unified_diff"], _PREVIEW_MAX_DIFF_CHARS)
+    truncated |= cut
+    return {**rec, "unified_diff": uni, "hunks": hunks, "heuristics": heur}, truncated
+
 st.set_page_config(page_title="Quick Diff + JSONL", layout="wide")
 render_about_sidebar()
 st.title("🔍 Quick Diff → JSONL (LLM-ready)")
@@ -277,12 +469,15 @@ st.title("🔍 Quick Diff → JSONL (LLM-ready)")
 mode = st.radio("Input mode", ["Paste text", "Upload files"], horizontal=True)
 
 def read_bytes_as_text(b: bytes) -> str:
-    for enc in ("utf-8", "utf-16", "latin-1"):
-        try:
-            return b.decode(enc)
-        except Exception:
-            continue
-    return b.decode("utf-8", errors="ignore")
+    # BOM sniff first, then a single strict UTF-8 attempt; latin-1 cannot fail, so at most two decode passes
+    if b[:3] == codecs.BOM_UTF8:
+        return b[3:].decode("utf-8", errors="replace")
+    if b[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return b.decode("utf-16", errors="replace")
+    try:
+        return b.decode("utf-8")
+    except UnicodeDecodeError:
+        return b.decode("latin-1")
 
 # inputs
 left_text = right_text = ""
@@ -326,60 +521,111 @@ with st.expander("Diff options", expanded=False):
 
 go = st.button("Compare & Build JSON", type="primary")
 
+# Everything the stored results depend on; compared on each rerun to detect stale results
+current_inputs = (left_text, right_text, left_name, right_name, n_context, strip_ws)
+
 if go:
     if not left_text or not right_text:
         st.warning("Please provide text on both sides (or upload two files) before comparing.")
+        for k in ("last_rec", "last_sims", "last_html", "last_pretty", "last_preview_truncated", "last_payload", "last_inputs"):
+            st.session_state.pop(k, None)
     else:
-        # Metrics
-        sm_char, sm_line, jacc = similarity_scores(left_text, right_text)
-        colA, colB, colC = st.columns(3)
-        with colA:
-            st.metric("Character similarity", f"{sm_char*100:.2f}%", delta=f"-{(1-sm_char)*100:.2f}% different")
-        with colB:
-            st.metric("Line similarity", f"{sm_line*100:.2f}%", delta=f"-{(1-sm_line)*100:.2f}% different")
-        with colC:
-            st.metric("Token (Jaccard) similarity", f"{jacc*100:.2f}%", delta=f"-{(1-jacc)*100:.2f}% different")
-
-        # Unified diff + HTML
+        # Split once and share the line arrays with every downstream step
         left_lines  = to_lines(left_text, strip_ws)
         right_lines = to_lines(right_text, strip_ws)
-        st.subheader("📄 Unified diff")
-        uni = unified_diff_text(left_lines, right_lines, left_name, right_name, n_context=n_context)
-        st.code(uni, language="diff")
+        left_raw_lines  = left_text.splitlines()
+        right_raw_lines = right_text.splitlines()
 
-        st.subheader("🪞 Side-by-side HTML diff")
-        html = html_side_by_side(left_lines, right_lines, left_name, right_name)
-        components.html(html, height=500, scrolling=True)
-        st.download_button("Download HTML diff", data=html.encode("utf-8"), file_name="diff_report.html", mime="text/html")
+        # Metrics
+        sims = similarity_scores(left_text, right_text, left_raw_lines, right_raw_lines)
 
-        # Build record (Step 1) and show JSON preview
-        st.subheader("🧾 LLM-ready change record (JSON)")
-        rec = make_change_record(left_text, right_text, left_name, right_name, n_context=n_context, strip_ws=strip_ws)
-        pretty = json.dumps(rec, indent=2, ensure_ascii=False)
-        st.code(pretty, language="json")
-
-        # Save/append to JSONL (Step 2)
-        st.subheader("💾 Save as JSONL")
-        col1, col2 = st.columns([2,1])
-        with col1:
-            path = st.text_input("JSONL output path", value="changes.jsonl")
-        with col2:
-            append_now = st.button("Append to JSONL")
-        if append_now:
-            try:
-                save_jsonl([rec], path)
-                st.success(f"Appended record to {path}")
-            except Exception as e:
-                st.error(f"Failed to save JSONL: {e}")
-
-        # Also allow downloading this single JSON record
-        st.download_button(
-            "Download this JSON record",
-            data=pretty.encode("utf-8"),
-            file_name=f"{rec['id']}.json",
-            mime="application/json",
-            use_container_width=True
+        # Build record (Step 1); its unified diff and hunks come from a single pass over the diff lines
+        rec = make_change_record(
+            left_text, right_text, left_name, right_name, n_context=n_context, strip_ws=strip_ws,
+            left_lines=left_lines, right_lines=right_lines, sims=sims
         )
 
+        # HtmlDiff is quadratic in the worst case and its output grows with the input; skip it for big inputs
+        html = None
+        if (max(len(left_text), len(right_text)) < _HTML_DIFF_MAX_CHARS
+                and max(len(left_lines), len(right_lines)) < _HTML_DIFF_MAX_LINES):
+            html = html_side_by_side(left_lines, right_lines, left_name, right_name)
+
+        # Serialize the full record once (compact) for download; the on-screen preview is bounded
+        payload = json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        preview, preview_truncated = _preview_record(rec)
+        pretty = json.dumps(preview, indent=2, ensure_ascii=False)
+
+        # Keep the results so later reruns (e.g. "Append to JSONL") render and save without recomputing
+        st.session_state["last_rec"] = rec
+        st.session_state["last_sims"] = sims
+        st.session_state["last_html"] = html
+        st.session_state["last_pretty"] = pretty
+        st.session_state["last_preview_truncated"] = preview_truncated
+        st.session_state["last_payload"] = payload
+        st.session_state["last_inputs"] = current_inputs
+
+if "last_rec" in st.session_state:
+    rec = st.session_state["last_rec"]
+    sm_char, sm_line, jacc = st.session_state["last_sims"]
+    html = st.session_state["last_html"]
+
+    # Inputs or options changed since the last Compare: keep showing the old results, but don't let them be appended
+    stale = st.session_state["last_inputs"] != current_inputs
+    if stale:
+        st.info("Inputs or diff options changed since the last comparison; results below are stale. "
+                "Click \"Compare & Build JSON\" to refresh them before appending.")
+
+    if rec["stats"].get("similarity_method") == "line_set_jaccard":
+        st.warning("Large input: used approximate similarity (line-set Jaccard instead of SequenceMatcher).")
+
+    colA, colB, colC = st.columns(3)
+    with colA:
+        st.metric("Character similarity", f"{sm_char*100:.2f}%", delta=f"-{(1-sm_char)*100:.2f}% different")
+    with colB:
+        st.metric("Line similarity", f"{sm_line*100:.2f}%", delta=f"-{(1-sm_line)*100:.2f}% different")
+    with colC:
+        st.metric("Token (Jaccard) similarity", f"{jacc*100:.2f}%", delta=f"-{(1-jacc)*100:.2f}% different")
+
+    # Unified diff + HTML
+    st.subheader("📄 Unified diff")
+    st.code(rec["unified_diff"], language="diff")
+
+    st.subheader("🪞 Side-by-side HTML diff")
+    if html is not None:
+        components.html(html, height=500, scrolling=True)
+        st.download_button("Download HTML diff", data=html.encode("utf-8"), file_name="diff_report.html", mime="text/html")
+    else:
+        st.info("Side-by-side view skipped: input too large; unified diff and JSON record still generated.")
+
+    # JSON preview of the record
+    st.subheader("🧾 LLM-ready change record (JSON)")
+    st.code(st.session_state["last_pretty"], language="json")
+    if st.session_state["last_preview_truncated"]:
+        st.caption("Preview truncated; the download and JSONL export contain the full record.")
+
+    # Save/append to JSONL (Step 2)
+    st.subheader("💾 Save as JSONL")
+    col1, col2 = st.columns([2,1])
+    with col1:
+        path = st.text_input("JSONL output path", value="changes.jsonl")
+    with col2:
+        append_now = st.button("Append to JSONL", disabled=stale)
+    if append_now and not stale:
+        try:
+            save_jsonl([rec], path)
+            st.success(f"Appended record to {path}")
+        except Exception as e:
+            st.error(f"Failed to save JSONL: {e}")
+
+    # Also allow downloading this single JSON record
+    st.download_button(
+        "Download this JSON record",
+        data=st.session_state["last_payload"],
+        file_name=f"{rec['id']}.json",
+        mime="application/json",
+        use_container_width=True
+    )
+
 # Small tip
 st.caption("Tip: Append multiple comparisons into one JSONL file (one JSON object per line) to build a review dataset.")